@@ -1,10 +1,14 @@
 from typing import Iterable, Mapping
+from dataclasses import dataclass
 import numpy as np
 import logging
 import importlib
+import os
+import random
 
 import cocotb
 from cocotb.triggers import RisingEdge as RE, FallingEdge as FE, Timer
+from cocotb.clock import Clock
 from cocotb.handle import SimHandleBase
 # from cocotb_coverage.coverage import *
 cocotb_coverage = importlib.import_module('cocotb-coverage.cocotb_coverage.coverage')
@@ -26,6 +30,34 @@ from cocotb_util.cocotb_util import static_vars
 CHIP_ID = 3  # Hardcoded in RTL
 CHIP_ADDR = 0  # 3-bit chip addr, defined by ROCK external inputs
 
+_X_VAL = cocotb.handle.BinaryValue('x')  # idle MOSI value
+
+# SPI request frame field names indexed by bit number (LSB first)
+_WR_FIELD_TAGS = (
+    ('Stp',) + ('Rsv',) * 2 + ('Reg data',) * 16 + ('Reg addr',) * 8 + ('Br', 'WRn') + ('Chip addr',) * 3)
+# SPI request frame field names as seen by monitor (WRn bit is labeled by its value)
+_RD_REQ_FIELD_TAGS = (
+    ('Stp',) + ('X',) * 2 + ('Reg data written',) * 16 + ('Reg addr',) * 8 + ('X', 'WRn') + ('Chip addr wr',) * 3)
+# SPI read response frame field names indexed by bit number (LSB first)
+_RD_RESP_FIELD_TAGS = (
+    ('Zero bits',) * 3 + ('Status',) + ('Reg data',) * 16 + ('Br', 'WRn') + ('Chip addr rd',) * 3 + ('One bit',)
+    + ('Zero bits',) * 6)
+
+
+@dataclass(frozen=True, slots=True)
+class RockSpiBusCfg:
+    """SPI bus geometry. One instance is shared by agent driver and monitor"""
+    freq_mhz: float = 12.5
+    chip_addr: int = 0  # soft config
+    n_sclk: int = 32
+    brd: int = 0  # no broadcast
+    rsv: int = 0  # reserved bit
+    stop_bit: int = 1  # stop bit
+
+    @property
+    def sclk_half_period_us(self) -> float:
+        return 1 / (2 * self.freq_mhz)
+
 
 class RockSpiDriver(BusDriver):
     def __init__(
@@ -37,7 +69,8 @@ class RockSpiDriver(BusDriver):
         freq_mhz: float = 12.5,
         probes: Mapping[str, SimHandleBase] = None,
         # soft config
-        chip_addr: int = 0
+        chip_addr: int = 0,
+        bus_cfg: RockSpiBusCfg = None
     ):
 
         signals = {sig: f'{sig.upper()}_{spi_idx}' for sig in spi_signals}
@@ -47,31 +80,35 @@ class RockSpiDriver(BusDriver):
             probes=probes)
 
         # SPI bus config
-        self.sclk_half_period_us = 1 / (2 * freq_mhz)
-        self.chip_addr = chip_addr
-        self.n_sclk = 32
-        self.brd = 0  # no broadcast
-        self.rsv = 0  # reserved bit
-        self.stop_bit = 1  # stop bit
+        self.bus_cfg = bus_cfg if bus_cfg is not None else RockSpiBusCfg(freq_mhz=freq_mhz, chip_addr=chip_addr)
+        cfg = self.bus_cfg
+        # trx independent part of the request frame
+        self._hdr_mask = (
+            ((cfg.chip_addr & 7) << 29) | ((cfg.brd & 1) << 27) | ((cfg.rsv & 3) << 1) | (cfg.stop_bit & 1))
+
+        # bind hot-path handles once to skip the Bus attribute lookup per bit
+        self._sclk = self.bus.i_sclk
+        self._cs_n = self.bus.i_cs_n
+        self._mosi = self.bus.i_mosi
+        self._sclk_clk = Clock(self._sclk, 2 * cfg.sclk_half_period_us, units='us')
+        self._sclk_half_period = Timer(cfg.sclk_half_period_us, units='us')
+        # (bit number, field name) in transmit order, MSB first
+        self._wr_bits = tuple((i, _WR_FIELD_TAGS[i]) for i in reversed(range(cfg.n_sclk)))
 
         # init SPI bus
         self.bus.i_sclk.value = 0
         self.bus.i_cs_n.value = 1
-        self.bus.i_mosi.value = cocotb.handle.BinaryValue('x')
+        self.bus.i_mosi.value = _X_VAL
 
     async def gen_cs_sclk(self, n_sclk=None):
         """Generate 'cs' and 'clk'"""
-        self.log.debug(f"Generating cs and sclk")
-        n_sclk = n_sclk if n_sclk is not None else self.n_sclk
-        self.bus.i_cs_n.value = 0
-        for i in range(n_sclk):
-            self.bus.i_sclk.value = 0
-            await Timer(self.sclk_half_period_us, units="us")
-            self.bus.i_sclk.value = 1
-            await Timer(self.sclk_half_period_us, units="us")
-        self.bus.i_sclk.value = 0
+        self.log.debug("Generating cs and sclk")
+        n_sclk = n_sclk if n_sclk is not None else self.bus_cfg.n_sclk
+        self._cs_n.value = 0
+        await self._sclk_clk.start(cycles=n_sclk, start_high=False)
+        self._sclk.value = 0
         await Timer(20, units='ns')
-        self.bus.i_cs_n.value = 1
+        self._cs_n.value = 1
 
     def check_trx(self, trx):
         """Check applied trx consistency"""
@@ -94,55 +131,49 @@ class RockSpiDriver(BusDriver):
             Rd mode: Send first trx. Then send second trx wo input data to provide 'cs' and 'clk'
             for reading response on output"""
 
-        self.log.info(f"Sending {repr(trx)}")
-
-        cocotb.start_soon(self.gen_cs_sclk())
-        for i in reversed(range(self.n_sclk)):
-            await RE(self.bus.i_sclk)
-            if i in [31, 30, 29]:
-                wr_info = 'Chip addr'
-                self.bus.i_mosi.value = (self.chip_addr >> (i - 29)) & 1
-            elif i == 28:
-                wr_info = 'WRn'
-                self.bus.i_mosi.value = trx.wrn
-            elif i == 27:
-                wr_info = 'Br'
-                self.bus.i_mosi.value = self.brd
-            elif i in range(19, 27):
-                wr_info = 'Reg addr'
-                self.bus.i_mosi.value = (trx.reg_addr >> (i - 19)) & 1
-            elif i in range(3, 19):
-                wr_info = 'Reg data'
-                self.bus.i_mosi.value = (trx.reg_data >> (i - 3)) & 1
-            elif i in [1, 2]:
-                wr_info = 'Rsv'
-                self.bus.i_mosi.value = self.rsv
-            elif i == 0:
-                wr_info = 'Stp'
-                self.bus.i_mosi.value = self.stop_bit
-            else:
-                wr_info = 'X'
-            assign_probe_str(self.probes.get('wr_info', None), wr_info)
-            assign_probe_int(self.probes.get('i', None), i)
-            await Timer(1, units='ns')
-            self.log.debug(f'{wr_info} : {i} : {self.bus.i_mosi.value}')
-
-        await RE(self.bus.i_cs_n)
-        self.bus.i_mosi.value = cocotb.handle.BinaryValue('x')
-        assign_probe_str(self.probes.get('wr_info', None), '')
-        self.log.debug(f"Finish sending trx: {trx}")
+        self.log.info("Sending %r", trx)
+        wr_info_probe = self.probes.get('wr_info', None)
+        i_probe = self.probes.get('i', None)
+        probes_on = wr_info_probe is not None or i_probe is not None
+        sclk, mosi = self._sclk, self._mosi
+        log_dbg = self.log.debug
+        dbg_on = self.log.isEnabledFor(logging.DEBUG)
+
+        # pack the whole frame once, then just shift it out bit by bit
+        word = self._hdr_mask | (trx.wrn << 28) | (trx.reg_addr << 19) | (trx.reg_data << 3)
+
+        # generate cs/sclk and drive MOSI on sclk rising edge in one coroutine
+        half_period = self._sclk_half_period
+        self._cs_n.value = 0
+        for i, wr_info in self._wr_bits:
+            sclk.value = 0
+            await half_period
+            sclk.value = 1
+            mosi.value = (word >> i) & 1
+            if probes_on:
+                assign_probe_str(wr_info_probe, wr_info)
+                assign_probe_int(i_probe, i)
+            if dbg_on:
+                log_dbg('%s : %d : %d', wr_info, i, (word >> i) & 1)
+            await half_period
+        sclk.value = 0
+        await Timer(20, units='ns')
+        self._cs_n.value = 1
+        mosi.value = _X_VAL
+        assign_probe_str(wr_info_probe, '')
+        self.log.debug("Finish sending trx: %s", trx)
         await Timer(200, units='ns')  # pause between trx
-        self.log.debug(f"Finish pause after trx")
+        self.log.debug("Finish pause after trx")
 
         # Second trx when reading
         if trx.wrn == 0:
-            self.log.debug(f"Starting read response trx")
-            assign_probe_str(self.probes.get('wr_info', None), 'Read response trx')
+            self.log.debug("Starting read response trx")
+            assign_probe_str(wr_info_probe, 'Read response trx')
             await self.gen_cs_sclk()
-            assign_probe_str(self.probes.get('wr_info', None), '')
-            self.log.debug(f"Finish read response trx")
-            await Timer(np.random.randint(10, 200), units='ns')  # random pause between trx
-            self.log.debug(f"Finish pause after trx")
+            assign_probe_str(wr_info_probe, '')
+            self.log.debug("Finish read response trx")
+            await Timer(random.randint(10, 199), units='ns')  # random pause between trx
+            self.log.debug("Finish pause after trx")
 
 
 class RockSpiMonitor(BusMonitor):
@@ -157,7 +188,8 @@ class RockSpiMonitor(BusMonitor):
         freq_mhz: float = 12.5,
         probes: Mapping[str, SimHandleBase] = None,
         # soft config
-        chip_addr: int = 0
+        chip_addr: int = 0,
+        bus_cfg: RockSpiBusCfg = None
     ):
         signals = {sig: f'{sig.upper()}_{spi_idx}' for sig in spi_signals}
         super().__init__(
@@ -165,97 +197,92 @@ class RockSpiMonitor(BusMonitor):
             signals=signals,
             probes=probes)
 
-        # SPI bus hard config
-        self.sclk_half_period_us = 1 / (2 * freq_mhz)
-        self.n_sclk = 32
-        self.brd = 0  # no broadcast
-        self.rsv = 0  # reserved bit
-        self.stop_bit = 1  # stop bit
-        # soft config
-        self.chip_addr = chip_addr  # we should listen only given chip_addr
+        # SPI bus config. We should listen only given chip_addr
+        self.bus_cfg = bus_cfg if bus_cfg is not None else RockSpiBusCfg(freq_mhz=freq_mhz, chip_addr=chip_addr)
+
+        # bind hot-path handles once to skip the Bus attribute lookup per bit
+        self._sclk = self.bus.i_sclk
+        self._cs_n = self.bus.i_cs_n
+        self._mosi = self.bus.i_mosi
+        self._miso = self.bus.o_miso
+        # (bit number, field name) in receive order, MSB first
+        self._rd_req_bits = tuple((i, _RD_REQ_FIELD_TAGS[i]) for i in reversed(range(self.bus_cfg.n_sclk)))
+        self._rd_resp_bits = tuple((i, _RD_RESP_FIELD_TAGS[i]) for i in reversed(range(self.bus_cfg.n_sclk)))
 
     async def receive(self):
         while True:
             # wait for read request
-            await FE(self.bus.i_cs_n)
-            chip_addr_wr = 0
-            reg_addr = 0
-            reg_data_wr = 0
-            reg_data_rd = 0
-            for i in reversed(range(self.n_sclk)):
-                await FE(self.bus.i_sclk)
-                assert self.bus.i_mosi.value.binstr in ['0', '1']
-                if i in [31, 30, 29]:
-                    rd_info = 'Chip addr wr'
-                    chip_addr_wr = (chip_addr_wr << 1) | self.bus.i_mosi.value
-                elif i == 28:
-                    if (self.bus.i_mosi.value == 0):
-                        wrn = 0
-                        rd_info = 'Rd op'
-                        self.log.debug('Read request detected')
-                    else:
-                        wrn = 1
-                        rd_info = 'Wr op'
-                elif i in range(19, 27):
-                    rd_info = 'Reg addr'
-                    reg_addr = (reg_addr << 1) | self.bus.i_mosi.value
-                elif i in range(3, 19):
-                    rd_info = 'Reg data written'
-                    reg_data_wr = (reg_data_wr << 1) | self.bus.i_mosi.value
-                elif i == 0:
-                    rd_info = 'Stp'
-                    assert self.bus.i_mosi.value == self.stop_bit
-                else:
-                    rd_info = 'X'
-                self.log.debug(f'{rd_info} : {i} : {self.bus.i_mosi.value}')
-                assign_probe_str(self.probes.get('rd_info', None), rd_info)
-                assign_probe_int(self.probes.get('i', None), i)
+            await FE(self._cs_n)
+            rd_info_probe = self.probes.get('rd_info', None)
+            i_probe = self.probes.get('i', None)
+            probes_on = rd_info_probe is not None or i_probe is not None
+            sclk, mosi, miso = self._sclk, self._mosi, self._miso
+            log_dbg = self.log.debug
+            dbg_on = self.log.isEnabledFor(logging.DEBUG)
+            chip_addr = self.bus_cfg.chip_addr
+            foreign = False
+            word = 0
+            for i, rd_info in self._rd_req_bits:
+                await FE(sclk)
+                bit = int(mosi.value)  # fails on unresolved 'x'/'z' bit
+                word = (word << 1) | bit
+                if i == 28:
+                    rd_info = 'Wr op' if bit else 'Rd op'
+                if dbg_on:
+                    log_dbg('%s : %d : %d', rd_info, i, bit)
+                if probes_on:
+                    assign_probe_str(rd_info_probe, rd_info)
+                    assign_probe_int(i_probe, i)
+                # chip addr, wrn and brd are known: drop trx neither addressed to us nor broadcast
+                if i == 27 and (word >> 2) != chip_addr and not word & 1:
+                    foreign = True
+                    break
+
+            if foreign:
+                self.log.debug('Skip trx for chip addr %d', word >> 2)
+                await RE(self._cs_n)
+                if not (word >> 1) & 1:
+                    # skip read response frame as well
+                    await FE(self._cs_n)
+                    await RE(self._cs_n)
+                continue
+
+            # decode request fields at once
+            chip_addr_wr = (word >> 29) & 0x7
+            wrn = (word >> 28) & 1
+            reg_addr = (word >> 19) & 0xFF
+            reg_data_wr = (word >> 3) & 0xFFFF
+            assert (word & 1) == self.bus_cfg.stop_bit
 
             # handle read response
             if wrn == 0:
-                chip_addr_rd = 0
-                status = ''
-                await FE(self.bus.i_cs_n)
-                self.log.debug(f"Starting reading response")
-                for i in reversed(range(self.n_sclk)):
-                    await FE(self.bus.i_sclk)
-                    assert self.bus.o_miso.value.binstr in ['0', '1']
-                    if i in [31, 30, 29, 28, 27, 26]:
-                        rd_info = 'Zero bits'
-                        # assert self.bus.o_miso.value == 0
-                    elif i == 25:
-                        rd_info = 'One bit'
-                    elif i in [24, 23, 22]:
-                        rd_info = 'Chip addr rd'
-                        chip_addr_rd = (chip_addr_rd << 1) | self.bus.o_miso.value
-                    elif i == 21:
-                        rd_info = 'WRn'
-                        assert chip_addr_wr == chip_addr_rd, "Chip addr mismatch"
-                    elif i == 20:
-                        rd_info = 'Br'
-                    elif i in range(4, 20):
-                        rd_info = 'Reg data'
-                        reg_data_rd = (reg_data_rd << 1) | self.bus.o_miso.value
-                    elif i == 3:
-                        rd_info = 'Status'
-                        status = "Ok" if self.bus.o_miso.value.binstr == '0' else 'Error'
-                        assert status == 'Ok', "Error read status detected!"
-                    elif i in [2, 1, 0]:
-                        rd_info = 'Zero bits'
-                        # assert self.bus.o_miso.value.binstr == '0'
-                    else:
-                        rd_info = 'X'
-                    assign_probe_str(self.probes.get('rd_info', None), rd_info)
-                    assign_probe_int(self.probes.get('i', None), i)
-                    await Timer(1, units='ns')
-                    self.log.debug(f'{rd_info} : {i} : {self.bus.o_miso.value}')
-
-                await RE(self.bus.i_cs_n)
-                self.log.debug(f"Finish reading response")
-                self.log.debug(f'Read trx: Chip addr={chip_addr_rd} : Data={reg_data_rd} : Status={status}')
+                self.log.debug('Read request detected')
+                word = 0
+                await FE(self._cs_n)
+                self.log.debug("Starting reading response")
+                for i, rd_info in self._rd_resp_bits:
+                    await FE(sclk)
+                    bit = int(miso.value)  # fails on unresolved 'x'/'z' bit
+                    word = (word << 1) | bit
+                    if probes_on:
+                        assign_probe_str(rd_info_probe, rd_info)
+                        assign_probe_int(i_probe, i)
+                    if dbg_on:
+                        log_dbg('%s : %d : %d', rd_info, i, bit)
+
+                # decode response fields at once
+                chip_addr_rd = (word >> 22) & 0x7
+                reg_data_rd = (word >> 4) & 0xFFFF
+                status = 'Ok' if ((word >> 3) & 1) == 0 else 'Error'
+                assert chip_addr_wr == chip_addr_rd, "Chip addr mismatch"
+                assert status == 'Ok', "Error read status detected!"
+
+                await RE(self._cs_n)
+                self.log.debug("Finish reading response")
+                self.log.debug('Read trx: Chip addr=%d : Data=%d : Status=%s', chip_addr_rd, reg_data_rd, status)
 
             reg_data = reg_data_rd if wrn == 0 else reg_data_wr
-            self.log.info(f"Monitor recieved: wrn={wrn}, reg_addr={reg_addr}, reg_data={reg_data}")
+            self.log.info("Monitor recieved: wrn=%d, reg_addr=%d, reg_data=%d", wrn, reg_addr, reg_data)
             return wrn, reg_addr, reg_data
 
 
@@ -276,14 +303,14 @@ class RockSpiAgent(BusAgent):
         super().__init__()
 
         self.rock_spi_signals = ["i_sclk", "i_cs_n", "i_mosi", "o_miso"]
+        self.bus_cfg = RockSpiBusCfg(freq_mhz=freq_mhz, chip_addr=chip_addr)
 
         self.add_driver(
             RockSpiDriver(
                 entity,
                 spi_signals=self.rock_spi_signals,
                 spi_idx=spi_idx,
-                freq_mhz=freq_mhz,
-                chip_addr=chip_addr) if driver.lower() == 'on' else None
+                bus_cfg=self.bus_cfg) if driver.lower() == 'on' else None
         )
 
         self.add_monitor(
@@ -291,8 +318,7 @@ class RockSpiAgent(BusAgent):
                 entity,
                 spi_signals=self.rock_spi_signals,
                 spi_idx=spi_idx,
-                freq_mhz=freq_mhz,
-                chip_addr=chip_addr) if monitor.lower() == 'on' else None
+                bus_cfg=self.bus_cfg) if monitor.lower() == 'on' else None
         )
 
 class RockSpiTrx(Transaction):
@@ -337,11 +363,14 @@ class RockSpiTrx(Transaction):
             else:
                 return wrn in [0, 1]
 
+        reg_data_range_weights = self.reg_data_range_weights
+
         def reg_data_cstr(reg_data_range, wrn):
             if wrn == 1:
-                return self.reg_data_range_weights[reg_data_range]
+                return reg_data_range_weights[reg_data_range]
             else:
-                return True   # doesn't matter
+                # doesn't matter for read: pin to a single value to shrink solver domain
+                return reg_data_range == 'min0'
 
         self.add_constraint(reg_name_cstr)
         self.add_constraint(wrn_cstr)
@@ -349,16 +378,24 @@ class RockSpiTrx(Transaction):
         self.solve_order('reg_name', 'wrn', 'reg_data_range')
 
     def post_randomize(self):
-        self.reg_addr = self.regs[self.reg_name]['addr']
-
-        max_val = self.regs[self.reg_name]['max_val']
-        self.reg_data = dict(zip(
-            self.reg_data_ranges,
-            (0, 1, np.random.randint(0, max_val + 1), max_val - 1, max_val))
-        )[self.reg_data_range]
+        reg = self.regs[self.reg_name]
+        self.reg_addr = reg['addr']
+
+        max_val = reg['max_val']
+        reg_data_range = self.reg_data_range
+        if reg_data_range == 'min0':
+            self.reg_data = 0
+        elif reg_data_range == 'min1':
+            self.reg_data = 1
+        elif reg_data_range == 'mid':
+            self.reg_data = random.randint(0, max_val)
+        elif reg_data_range == 'max0':
+            self.reg_data = max_val - 1
+        else:
+            self.reg_data = max_val
 
         self.read_reg_data_expected = None
-        self.log.debug(repr(self))
+        self.log.debug('%r', self)
 
 
 class RockSpiCoverProcessor(CoverProcessor):
@@ -372,22 +409,22 @@ class RockSpiCoverProcessor(CoverProcessor):
     def define(self):
         self.log.info('Define coverage')
 
+        # reg data bin predicates: (check_value, max_val) -> bool
+        bin_preds = {
+            'min0': lambda value, max_val: value == 0,
+            'min1': lambda value, max_val: value == 1,
+            'max0': lambda value, max_val: value == max_val,
+            'max1': lambda value, max_val: value == (max_val - 1),
+            'mid': lambda value, max_val: 0 <= value <= max_val if max_val < 4 else 2 <= value <= (max_val - 2),
+        }
+
+        # flat reg_name -> max_val view, regs are fixed once coverage is defined
+        max_vals = {reg_name: reg['max_val'] for reg_name, reg in self.regs.items()}
+
         def rel_reg_data(trx, bin):
-            max_val = self.regs[trx.reg_name]['max_val']
+            max_val = max_vals[trx.reg_name]
             check_value = trx.reg_data if trx.wrn == 1 else trx.read_reg_data_expected
-
-            if bin == 'min0':
-                return check_value == 0
-            elif bin == 'min1':
-                return check_value == 1
-            elif bin == 'max0':
-                return check_value == max_val
-            elif bin == 'max1':
-                return check_value == (max_val - 1)
-            elif bin == 'mid':
-                return 0 <= check_value <= max_val if max_val < 4 else 2 <= check_value <= (max_val - 2)
-            else:
-                return False
+            return bin_preds[bin](check_value, max_val)
 
         cross_ignore_bins = [
             # read only regs containing cons values
@@ -459,7 +496,9 @@ class RockTestBench(TestBench):
         self.coverage = RockSpiCoverProcessor(reg_cfg=self.cfg)
         self.coverage.add_status_report_callback(self.coverage_status_report)
         self.coverage.add_final_report_callback(self.coverage_final_report)
-        self.cfg['covered_regs'] = coverage_db['top.reg_name_rw_data_cross'].covered_bins['top.reg_name']
+        # cross coverage node queried on every trx
+        self._cross_cov = coverage_db['top.reg_name_rw_data_cross']
+        self.cfg['covered_regs'] = self._cross_cov.covered_bins['top.reg_name']
 
         # self.agent.monitor.log.setLevel(logging.DEBUG)
         # self.agent.driver.log.setLevel(logging.DEBUG)
@@ -467,11 +506,14 @@ class RockTestBench(TestBench):
         # self.coverage.log.setLevel(logging.DEBUG)
 
     def coverage_status_report(self):
-        self.log.info(f"Cross coverage: {coverage_db['top.reg_name_rw_data_cross'].cover_percentage:2.2f}")
+        # called on every collect(): skip formatting when INFO is filtered out
+        if not self.log.isEnabledFor(logging.INFO):
+            return
+        self.log.info("Cross coverage: %2.2f", self._cross_cov.cover_percentage)
 
         if 0 == self.runs % 50 and 0 != self.runs:
             # coverage_db.report_coverage(self.log.info, bins=True, node='top.reg_name_rw_data_cross')
-            self.log.info(f"Covered bins: {coverage_db['top.reg_name_rw_data_cross'].covered_bins}")
+            self.log.info(f"Covered bins: {self._cross_cov.covered_bins}")
 
     def coverage_final_report(self):
         coverage_db.report_coverage(self.log.info, bins=False)
@@ -501,68 +543,65 @@ class RockTestBench(TestBench):
         # Init Rd only default values
         self.regs['CHIP_ID_ADDR']['reset_reg_value'] = (CHIP_ID << 4) | CHIP_ADDR
 
-        # Remove 'unsupported Regs'
-        unsupported_regs = []
-        for reg_name in self.regs:
-            if self.regs[reg_name].get('unsupported', None) is not None:
-                unsupported_regs.append(reg_name)
-
-            if self.regs[reg_name].get('ignored', None) is not None:
-                unsupported_regs.append(reg_name)
-
-        for reg_name in unsupported_regs:
-            del self.regs[reg_name]
+        # Remove 'unsupported' and 'ignored' Regs
+        regs = self.cfg['regs'] = self.regs = {
+            reg_name: reg for reg_name, reg in self.regs.items()
+            if reg.get('unsupported', None) is None and reg.get('ignored', None) is None}
 
         # Handle array regs. There two 'array reg' pseudo-records which need to be replaced with array of regs
-        array_reg_names = [reg_name for reg_name in list(self.regs.keys()) if self.regs[reg_name].get('n_regs', 1) > 1]
+        array_reg_names = [reg_name for reg_name, reg in regs.items() if reg.get('n_regs', 1) > 1]
 
+        new_regs = {}
         for array_reg_name in array_reg_names:
+            array_reg = regs[array_reg_name]
+            start_addr = array_reg['addr']
             if array_reg_name == 'ANODE_BIAS_ADDR':
-                start_addr = self.regs[array_reg_name]['addr']
-                for reg_i in range(self.regs[array_reg_name]['n_regs']):
-                    reg_i_name = f'ANODE_BIAS_{reg_i}_ADDR'
-                    self.regs[reg_i_name] = {
+                for reg_i in range(array_reg['n_regs']):
+                    new_regs[f'ANODE_BIAS_{reg_i}_ADDR'] = {
                                             'addr':         start_addr + reg_i,
-                                            'bit_width':    self.regs[array_reg_name]['bit_width'],
-                                            'r_w':          self.regs[array_reg_name]['r_w'],
-                                            'reset_reg_value':    self.regs[array_reg_name]['reset_reg_value']
-
+                                            'bit_width':    array_reg['bit_width'],
+                                            'r_w':          array_reg['r_w'],
+                                            'reset_reg_value':    array_reg['reset_reg_value']
                                         }
-                del self.regs[array_reg_name]  # remove array reg pseudo-record
 
             elif array_reg_name == 'MBIST_RES_ADDR':
-                start_addr = self.regs[array_reg_name]['addr']
-                for reg_i in range(int(self.regs[array_reg_name]['n_regs'] / 3)):
+                for reg_i in range(int(array_reg['n_regs'] / 3)):
                     for j in range(3):
-                        reg_i_name = f'MBIST_RES{reg_i}_{j}_ADDR'
-                        self.regs[reg_i_name] = {
+                        new_regs[f'MBIST_RES{reg_i}_{j}_ADDR'] = {
                                                 'addr':         start_addr + reg_i * 3 + j,
                                                 'bit_width':    12 if j == 0 else 9,
-                                                'r_w':          self.regs[array_reg_name]['r_w']
+                                                'r_w':          array_reg['r_w']
                                             }
-                del self.regs[array_reg_name]  # remove array reg pseudo-record
 
             else:
                 assert False, "Missed array Reg"
 
-        self.cfg['reg_names'] = list(self.regs.keys())
+        # replace array reg pseudo-records with expanded regs
+        for array_reg_name in array_reg_names:
+            del regs[array_reg_name]
+        regs.update(new_regs)
+
+        self.cfg['reg_names'] = list(regs)
         # for key in cfg['reg_names']:
         #     print(f'{key:24}:{self.regs[key]}')
 
         # Calc max reg values
-        for reg_name in self.cfg['reg_names']:
-            self.regs[reg_name]['max_val'] = (1 << self.regs[reg_name]['bit_width']) - 1
+        for reg in regs.values():
+            reg['max_val'] = (1 << reg['bit_width']) - 1
 
     async def emulate_mce_frame(self, dut):
         """"Emulate MCE frame with random timing in parallel to SPI access to provocate 'postponed SPI regs write' mechanism usage"""
+        mce = dut.dtop_dut.I_MCE
         await Timer(20, units='ns')
         while 1:
-            mce_high_length = np.random.randint(1900, 2100)
-            mce_low_length = np.random.randint(50, 250)
-            dut.dtop_dut.I_MCE.value = 1
-            await Timer(mce_high_length, units='ns')
-            dut.dtop_dut.I_MCE.value = 0
-            await Timer(mce_low_length, units='ns')
+            # draw frame timings in batches instead of two RNG calls per frame
+            mce_high_lengths = np.random.randint(1900, 2100, size=1024).tolist()
+            mce_low_lengths = np.random.randint(50, 250, size=1024).tolist()
+            for mce_high_length, mce_low_length in zip(mce_high_lengths, mce_low_lengths):
+                mce.value = 1
+                await Timer(mce_high_length, units='ns')
+                mce.value = 0
+                await Timer(mce_low_length, units='ns')
 
     async def catch_mbist_run(self, dut):
         await Timer(20, units='ns')
@@ -574,29 +613,29 @@ class RockTestBench(TestBench):
     def stop(self):
         """Stop testing when test goal achieved."""
         return (self.runs >= self.max_runs
-            or coverage_db['top.reg_name_rw_data_cross'].cover_percentage == 100)
+            or self._cross_cov.cover_percentage == 100)
 
     async def run(self):
         """Send transactions. Store expected responces."""
-        cocotb.start_soon(self.emulate_mce_frame(self.dut))
+        if os.environ.get('MCE_GEN_HDL', '0') != '1':  # otherwise MCE is generated by ttb
+            cocotb.start_soon(self.emulate_mce_frame(self.dut))
         cocotb.start_soon(self.catch_mbist_run(self.dut))
 
         for trx in self.sequencer(RockSpiTrx, self.stop, self.cfg):
+            reg = self.regs[trx.reg_name]
+
             # store info about runs: list of wr(1) or rd(0) runs
-            run_trx = self.regs[trx.reg_name].get('run_trx', None)
-            if run_trx is None:
-                self.regs[trx.reg_name]['run_trx'] = []
-            self.regs[trx.reg_name]['run_trx'].append(trx.wrn)
+            reg.setdefault('run_trx', []).append(trx.wrn)
 
             if trx.wrn == 0:  # read op
                 # extract last written data if exists and add to list of golds
-                read_reg_value_expected = self.regs[trx.reg_name].get('reg_value', None)
+                read_reg_value_expected = reg.get('reg_value', None)
                 if read_reg_value_expected is None:
-                    read_reg_value_expected = self.regs[trx.reg_name].get('reset_reg_value', 0)
+                    read_reg_value_expected = reg.get('reset_reg_value', 0)
                 trx.read_reg_data_expected = read_reg_value_expected
             else:  # write op
                 # store written reg data
-                self.regs[trx.reg_name]['reg_value'] = trx.reg_data
+                reg['reg_value'] = trx.reg_data
 
             self.agent.monitor.add_expected(trx)
 
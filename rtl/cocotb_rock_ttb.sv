@@ -26,5 +26,22 @@ initial
         timeout_sim(100ms, 1ms);
     end
 
+//--------------------------------------------------------------------------
+// MCE frame with random timing. Replaces python 'emulate_mce_frame' when MCE_GEN_HDL=1
+initial
+    begin
+        if ("1" == getenv("MCE_GEN_HDL"))
+            begin
+                #20ns;
+                forever
+                    begin
+                        force dtop_dut.I_MCE = 1'b1;
+                        #($urandom_range(2099, 1900) * 1ns);
+                        force dtop_dut.I_MCE = 1'b0;
+                        #($urandom_range(249, 50) * 1ns);
+                    end
+            end
+    end
+
 //--------------------------------------------------------------------------
 endmodule
\ No newline at end of file